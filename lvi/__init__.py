@@ -1,28 +1,112 @@
 """Library to handle connection with mill."""
 
 import asyncio
-import datetime as dt
+import collections
+import functools
 import hashlib
-import json
 import logging
-import random
-import string
+import platform
+import sys
+import threading
 import time
+from urllib.parse import urlencode
 import datetime
 
 import aiohttp
-import async_timeout
+
+try:
+    import orjson as json
+except ImportError:
+    import json
 
 API_ENDPOINT_1 = 'https://e3.lvi.eu/api/v0.1/human/'
 AUTH_ENDPOINT = 'https://e3.lvi.eu/api/v0.1/human/user/auth'
 
 DEFAULT_TIMEOUT = 10
-MIN_TIME_BETWEEN_UPDATES = dt.timedelta(seconds=2)
+RETRY_BACKOFF = 0.1
+BREAKER_FAILURES = 3
+BREAKER_WINDOW = 10
+MIN_TIME_BETWEEN_UPDATES = 2.0
 REQUEST_TIMEOUT = '300'
+TOKEN_EXPIRE_MARGIN = 300
+SMARTHOME_CACHE_TIME = 300
+
+# Preset: (gv_mode, temperatures sent in ADC, extra query fields)
+_PRESETS = {
+    'comfort': (0, ('consigne_confort', 'consigne_manuel'), {}),
+    'Program': (8, ('consigne_manuel',), {}),
+    'eco': (3, ('consigne_eco', 'consigne_manuel'), {}),
+    'boost': (4, ('consigne_boost', 'consigne_manuel'),
+              {'query[time_boost]': 7200}),
+    'off': (1, (), {'query[consigne_manuel]': 0}),
+}
+_DEFAULT_PRESET = (2, ('consigne_manuel', 'consigne_hg'), {})
+
+# Response code returned by the API when authentication fails
+_AUTH_FAILED = b'"code":"3"'
+
+_DEFAULT_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded",
+}
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _fast_loop_policy():
+    """Return the uvloop or uringcore event loop policy, if available."""
+    # pylint: disable=import-outside-toplevel
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        return uvloop.EventLoopPolicy()
+
+    if sys.platform.startswith('linux'):
+        release = platform.release().split('-')[0].split('.')
+        try:
+            kernel = (int(release[0]), int(release[1]))
+        except (IndexError, ValueError):
+            kernel = (0, 0)
+        if kernel >= (5, 11):
+            try:
+                import uringcore
+            except ImportError:
+                pass
+            else:
+                return uringcore.EventLoopPolicy()
+    return None
+
+
+def install_fast_loop():
+    """Install uvloop, or io_uring based uringcore, as event loop policy.
+
+    Must be called before the event loop is created. Returns True if a
+    faster event loop policy was installed.
+    """
+    policy = _fast_loop_policy()
+    if policy is None:
+        return False
+    asyncio.set_event_loop_policy(policy)
+    return True
+
+
+# Python versions leaking aborted SSL transports, see
+# https://github.com/python/cpython/pull/118960. Newer aiohttp warns when
+# enable_cleanup_closed is set on fixed versions.
+_NEEDS_CLEANUP_CLOSED = (sys.version_info < (3, 12, 8)
+                         or (3, 13, 0) <= sys.version_info < (3, 13, 1))
+
+
+def _create_session():
+    """Create a client session with a pooled keep-alive connector."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=32, limit_per_host=8, keepalive_timeout=75,
+            use_dns_cache=True, ttl_dns_cache=600,
+            enable_cleanup_closed=_NEEDS_CLEANUP_CLOSED))
+
+
 class Lvi:
     """Class to comunicate with the Mill api."""
 
@@ -30,53 +114,101 @@ class Lvi:
                  timeout=DEFAULT_TIMEOUT,
                  websession=None):
         """Initialize the LVI connection."""
-        if websession is None:
-            async def _create_session():
-                return aiohttp.ClientSession()
-
-            loop = asyncio.get_event_loop()
-            self.websession = loop.run_until_complete(_create_session())
-        else:
-            self.websession = websession
-        self._timeout = timeout
+        self.websession = websession
+        self._close_websession = websession is None
+        self._timeout = aiohttp.ClientTimeout(total=timeout, connect=5)
         self._username = username
-        self._password = password
+        # The credentials never change, encode the auth form once
+        self._auth_body = urlencode({
+            'email': username,
+            'password': hashlib.md5(password.encode('utf-8')).hexdigest(),
+        }).encode('utf-8')
         self._user_id = None
         self._token = None
         self._token_expire = None
         self.rooms = {}
         self.heaters = {}
-        self._throttle_time = None
-        self._throttle_all_time = None
+        self._smarthome_cache = None
+        self._smarthome_cache_time = 0
+        self._smarthome_task = None
+        self._connect_task = None
+        self._update_heaters_task = None
+        self._failures = collections.deque()
+        self._breaker_open_until = 0
+        self._throttle_time = 0.0
+        self._throttle_all_time = 0.0
+
+    @classmethod
+    async def create(cls, username, password,
+                     timeout=DEFAULT_TIMEOUT,
+                     websession=None):
+        """Create a LVI connection with a session reused for its lifetime."""
+        lvi = cls(username, password, timeout,
+                  websession or _create_session())
+        lvi._close_websession = websession is None
+        return lvi
+
+    async def __aenter__(self):
+        """Enter the Lvi connection context."""
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the session if it is owned by this connection."""
+        if self._close_websession:
+            await self.close_connection()
+
+    def _get_websession(self):
+        """Return the session, creating it on first use."""
+        if self.websession is None:
+            self.websession = _create_session()
+            self._close_websession = True
+        return self.websession
 
     async def connect(self, retry=2):
-        """Connect to LVI."""
+        """Connect to LVI, sharing a connection attempt in progress."""
+        if self._token_valid():
+            return True
+        if self._connect_task is None:
+            self._connect_task = asyncio.ensure_future(self._connect(retry))
+            self._connect_task.add_done_callback(self._connect_done)
+        return await asyncio.shield(self._connect_task)
+
+    def _connect_done(self, _task):
+        """Allow the next connect call to start a new attempt."""
+        self._connect_task = None
+
+    async def _connect(self, retry):
+        """Authenticate and store the token."""
         # pylint: disable=too-many-return-statements
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Connection": "Keep-Alive",
-        }
-
-        formData = aiohttp.FormData()
-        formData.add_field('email', self._username)
-        formData.add_field('password', hashlib.md5(
-            self._password.encode('utf-8')).hexdigest())
-
-        try:
-            with async_timeout.timeout(self._timeout):
-                resp = await self.websession.post(AUTH_ENDPOINT,
-                                                  data=formData,
-                                                  headers=headers)
-        except (asyncio.TimeoutError, aiohttp.ClientError):
-            if retry < 1:
-                _LOGGER.error("Error connecting to LVI", exc_info=True)
+        for attempt in range(retry + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            if self._breaker_open():
                 return False
-            return await self.connect(retry - 1)
+            error = None
+            try:
+                async with self._get_websession().post(
+                        AUTH_ENDPOINT, data=self._auth_body,
+                        headers=_DEFAULT_HEADERS,
+                        timeout=self._timeout) as resp:
+                    result = await resp.read()
+                if resp.status < 500:
+                    break
+            except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+                _LOGGER.debug("Error connecting to LVI", exc_info=True)
+                error = err
+            self._record_failure()
+        else:
+            _LOGGER.error("Error connecting to LVI", exc_info=error)
+            return False
+        self._failures.clear()
 
-        result = await resp.text()
+        if _AUTH_FAILED in result[:256]:
+            _LOGGER.error('Authentication failed')
+            return False
 
         data = json.loads(result)
-        if data.get('code').get('code') == '3':
+        if (data.get('code') or {}).get('code') == '3':
             _LOGGER.error('Authentication failed')
             return False
 
@@ -97,104 +229,191 @@ class Lvi:
 
         self._token = token
         self._user_id = user_id
-        self._token_expire = token_expire
+        self._token_expire = datetime.datetime.strptime(
+            token_expire, "%Y-%m-%d %H:%M:%S").timestamp()
         return True
 
-    def sync_connect(self):
-        """Close the Lvi connection."""
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.connect())
-        loop.run_until_complete(task)
+    def _token_valid(self):
+        """Check if the token is set and not about to expire."""
+        return (self._token is not None
+                and time.time() < self._token_expire - TOKEN_EXPIRE_MARGIN)
 
     async def close_connection(self):
         """Close the Lvi connection."""
-        await self.websession.close()
-
-    def sync_close_connection(self):
-        """Close the Lvi connection."""
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.close_connection())
-        loop.run_until_complete(task)
+        if self.websession is not None:
+            await self.websession.close()
+
+    async def request(self, command, payload, retry=3):
+        """Request data.
+
+        If the token is rejected, e.g. revoked before token_expire, connect
+        again once and repeat the request.
+        """
+        data = await self._request(command, payload, retry)
+        if data is False:
+            # Force a new token instead of reusing the rejected one
+            self._token_expire = 0
+            if await self.connect():
+                data = await self._request(command, payload, retry)
+        return data
 
-    async def request(self, command, formData, retry=3):
-        """Request data."""
+    async def _request(self, command, payload, retry):
+        """Send a request, returning False if authentication fails."""
         # pylint: disable=too-many-return-statements
 
         if self._token is None:
             _LOGGER.error("No token")
             return None
 
-        # Check self.token_expire and if date > expire, do:
-        if datetime.datetime.strptime(self._token_expire, "%Y-%m-%d %H:%M:%S") <= datetime.datetime.now():
-            if not await self.connect():
-                return None
-            return self.request(command, formData, retry - 1)
+        if self._breaker_open():
+            return None
+
+        if not self._token_valid() and not await self.connect():
+            return None
 
         url = API_ENDPOINT_1 + command
 
-        formData.add_field('token', self._token)
-        formData.add_field('email', self._username)
+        # Encode the form once, the body is reused if the request is retried
+        body = urlencode(dict(payload, token=self._token,
+                              email=self._username)).encode('utf-8')
 
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Connection": "Keep-Alive",
-        }
-        try:
-            with async_timeout.timeout(self._timeout):
-                resp = await self.websession.post(url,
-                                                  data=formData,
-                                                  headers=headers)
-        except asyncio.TimeoutError:
-            if retry < 1:
-                _LOGGER.error("Timed out sending command to LVI: %s", command)
+        for attempt in range(retry + 1):
+            if attempt:
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            if self._breaker_open():
                 return None
-            return await self.request(command, formData, retry - 1)
-        except aiohttp.ClientError:
-            _LOGGER.error("Error sending command to LVI: %s",
-                          command, exc_info=True)
+            error = None
+            try:
+                async with self._get_websession().post(
+                        url, data=body, headers=_DEFAULT_HEADERS,
+                        timeout=self._timeout) as resp:
+                    result = await resp.read()
+                if resp.status < 500:
+                    break
+            except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+                _LOGGER.debug("Error sending command to LVI: %s",
+                              command, exc_info=True)
+                error = err
+            self._record_failure()
+        else:
+            _LOGGER.error("No response from LVI for command: %s", command,
+                          exc_info=error)
             return None
-
-        result = await resp.text()
+        self._failures.clear()
 
         if not result:
             return None
 
+        # Skip parsing the body of authentication failures
+        if _AUTH_FAILED in result[:256]:
+            _LOGGER.error('Authentication failed')
+            return False
+
         data = json.loads(result)
-       # _LOGGER.error(result)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Response to %s: %d bytes, keys %s",
+                          command, len(result), list(data.get('data') or ()))
 
-        if data.get('code').get('code') != '1' and data.get('code').get('code') != '8':
+        if (data.get('code') or {}).get('code') not in ('1', '8'):
             _LOGGER.error('Authentication failed')
             return False
 
         return data
 
-    def sync_request(self, command, payload, retry=2):
-        """Request data."""
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.request(command, payload, retry))
-        return loop.run_until_complete(task)
+    def _breaker_open(self):
+        """Check if requests are paused after repeated failures."""
+        return time.monotonic() < self._breaker_open_until
+
+    def _record_failure(self):
+        """Pause requests when failures pile up within BREAKER_WINDOW."""
+        now = time.monotonic()
+        failures = self._failures
+        failures.append(now)
+        while now - failures[0] > BREAKER_WINDOW:
+            failures.popleft()
+        if len(failures) > BREAKER_FAILURES:
+            _LOGGER.warning("LVI is not responding, pausing requests for %ss",
+                            MIN_TIME_BETWEEN_UPDATES)
+            self._breaker_open_until = now + MIN_TIME_BETWEEN_UPDATES
+            failures.clear()
 
     async def get_smarthome_list(self):
         """Request data."""
-        form = aiohttp.FormData()
-
-        resp = await self.request("user/read", form)
-        if resp is None:
-            return []
-        return resp.get('data').get('smarthomes')
+        if (self._smarthome_cache is not None
+                and time.monotonic() - self._smarthome_cache_time
+                < SMARTHOME_CACHE_TIME):
+            return self._smarthome_cache
+
+        # Concurrent callers share the request already in progress
+        if self._smarthome_task is None:
+            self._smarthome_task = asyncio.ensure_future(
+                self._fetch_smarthome_list())
+            self._smarthome_task.add_done_callback(
+                self._fetch_smarthome_list_done)
+        return await asyncio.shield(self._smarthome_task)
+
+    def _fetch_smarthome_list_done(self, _task):
+        """Allow the next get_smarthome_list call to start a new request."""
+        self._smarthome_task = None
+
+    async def _fetch_smarthome_list(self):
+        """Request the smarthome list and cache it."""
+        resp = await self.request("user/read", {})
+        if not resp:
+            return {}
+        self._smarthome_cache = resp.get('data').get('smarthomes')
+        self._smarthome_cache_time = time.monotonic()
+        return self._smarthome_cache
+
+    def invalidate_smarthome_cache(self):
+        """Fetch the smarthome list again on next request."""
+        self._smarthome_cache = None
+
+    async def _read_smarthomes(self, errors=False):
+        """Read all smarthomes, and optionally their errors, concurrently.
+
+        Returns a list of (smarthome id, smarthome data, errors data)
+        tuples, where the errors data is None unless requested. Failed
+        requests are returned as their result or exception.
+        """
+        smarthomes = await self.get_smarthome_list()
+        smarthome_ids = [home.get('smarthome_id')
+                         for home in smarthomes.values()]
+        requests = []
+        for smarthome_id in smarthome_ids:
+            requests.append(self.request('/smarthome/read/',
+                                         _smarthome_form(smarthome_id)))
+            if errors:
+                requests.append(self.request(
+                    '/smarthome/get_errors/',
+                    _smarthome_form(smarthome_id, type_id='1')))
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        if not errors:
+            return [(smarthome_id, data, None)
+                    for smarthome_id, data in zip(smarthome_ids, results)]
+        return list(zip(smarthome_ids, results[::2], results[1::2]))
 
     async def update_rooms(self):
         """Request data."""
-        homes = await self.get_smarthome_list()
-        # Fetch zones
-        data = aiohttp.FormData()
-        data.add_field('smarthome_id', homes.get('0').get('smarthome_id'))
-        data = await self.request('/smarthome/read/', data)
+        for smarthome_id, data, _ in await self._read_smarthomes():
+            if not isinstance(data, dict):
+                _LOGGER.error("Failed to fetch zones: %s", data)
+                continue
+            self._set_rooms(smarthome_id, data)
+
+    def _set_rooms(self, smarthome_id, data):
+        """Update rooms from smarthome data.
+
+        Rooms are keyed by (smarthome_id, num_zone), zone numbers are only
+        unique within a smarthome.
+        """
         zone_data = data.get('data').get('zones')
         for key in zone_data:
             _id = key
             _index = zone_data[key].get('num_zone')
-            room = self.rooms.get(_index, Room())
+            room = self.rooms.get((smarthome_id, _index))
+            if room is None:
+                room = Room()
             room.zone_id = _id
             room.name = zone_data[key].get('zone_label')
             room.num_zone = _index
@@ -202,140 +421,114 @@ class Lvi:
             room.picto_zone_type = zone_data[key].get('picto_zone_type')
             room.zone_img_id = zone_data[key].get('zone_img_id')
             room.address_position = zone_data[key].get('address_position')
-            self.rooms[_index] = room
-
-    def sync_update_rooms(self):
-        """Request data."""
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.update_rooms())
-        return loop.run_until_complete(task)
+            self.rooms[(smarthome_id, _index)] = room
 
     async def update_heaters(self):
-        smarthome = await self.get_smarthome_list()
-        # Fetch devices
-        data = aiohttp.FormData()
-        data.add_field('smarthome_id', smarthome.get('0').get('smarthome_id'))
-        data = await self.request('/smarthome/read/', data)
+        """Request data, sharing an update already in progress.
+
+        Updates are throttled to one per MIN_TIME_BETWEEN_UPDATES.
+        """
+        if self._update_heaters_task is None:
+            now = time.monotonic()
+            if now - self._throttle_time < MIN_TIME_BETWEEN_UPDATES:
+                return
+            self._throttle_time = now
+            self._update_heaters_task = asyncio.ensure_future(
+                self._update_heaters())
+            self._update_heaters_task.add_done_callback(
+                self._update_heaters_done)
+        await asyncio.shield(self._update_heaters_task)
+
+    def _update_heaters_done(self, _task):
+        """Allow the next update_heaters call to start a new update."""
+        self._update_heaters_task = None
+
+    async def _update_heaters(self):
+        """Request data."""
+        for smarthome_id, data, error in await self._read_smarthomes(
+                errors=True):
+            if not isinstance(data, dict):
+                _LOGGER.error("Failed to fetch devices: %s", data)
+                continue
+            self._set_heaters(smarthome_id, data, error)
+
+    def _set_heaters(self, smarthome_id, data, error):
+        """Update heaters from smarthome and errors data."""
         heater_data = data.get('data').get('devices')
-
-        _data = aiohttp.FormData()
-        _data.add_field('smarthome_id', smarthome.get('0').get('smarthome_id'))
-        _data.add_field('type_id', '1')
-        errors = await self.request("/smarthome/get_errors/", _data)
-        errors_data = errors.get('data').get('results').get('by_device')
-
-        for _key in heater_data:
-            _id = heater_data[_key].get('id_device')
-            heater = self.heaters.get(_id, Heater())
+        if isinstance(error, dict):
+            errors_data = error.get('data').get('results').get('by_device')
+        else:
+            # Availability is unknown, keep the previous value
+            _LOGGER.error("Failed to fetch device errors: %s", error)
+            errors_data = None
+
+        heaters = self.heaters
+        for device in heater_data.values():
+            _id = device.get('id_device')
+            heater = heaters.get(_id)
+            if heater is None:
+                heater = Heater()
             heater.device_id = _id
-            await set_heater_values(self, heater_data[_key], heater)
-            if _id in errors_data:
-                heater.available = False
-            else:
-                heater.available = True
-
-            self.heaters[_id] = heater
+            set_heater_values(self, device, heater)
+            heater.room = self.rooms.get((smarthome_id, heater.num_zone))
+            if errors_data is not None:
+                heater.available = _id not in errors_data
 
-    def sync_update_heaters(self):
-        """Request data."""
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.update_heaters())
-        loop.run_until_complete(task)
+            heaters[_id] = heater
 
     async def set_heater_temp(self, device_id, set_temp):
-        data = aiohttp.FormData()
-        data.add_field('query[id_device]', device_id)
-        data.add_field('context', '1')
+        """Set heater temperature."""
+        heater = self.heaters.get(device_id)
+        if heater is None:
+            _LOGGER.error("No such device")
+            return
         _adc = celsiusToAdc(set_temp)
-        for key in self.heaters:
-            if self.heaters[key].device_id == device_id:
-                data.add_field('query[consigne_confort]', _adc)
-                data.add_field('query[consigne_manuel]', _adc)
-                # Add gv_mode 0 for manual set
-                data.add_field('smarthome_id', self.heaters[key].smarthome_id)
-                break
+        data = {
+            'query[id_device]': device_id,
+            'context': '1',
+            'query[consigne_confort]': _adc,
+            'query[consigne_manuel]': _adc,
+            'smarthome_id': heater.smarthome_id,
+        }
 
         await self.request("query/push/", data)
 
-    def sync_set_heater_temp(self, device_id, set_temp):
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.set_heater_temp(device_id, set_temp))
-        loop.run_until_complete(task)
+    async def set_heater_temps(self, temps):
+        """Set temperatures of several heaters concurrently.
+
+        temps is an iterable of (device_id, set_temp) pairs.
+        """
+        await asyncio.gather(*[self.set_heater_temp(device_id, set_temp)
+                               for device_id, set_temp in temps])
 
     async def set_heater_preset(self, device_id, preset):
         """Update preset."""
-        data = aiohttp.FormData()
-        data.add_field('query[id_device]', device_id)
-        data.add_field('context', '1')
-        data.add_field('smarthome_id', self.heaters[device_id].smarthome_id)
-        if preset == 'comfort':
-            self.heaters[device_id].gv_mode = 0
-            data.add_field('query[gv_mode]', 0)
-            data.add_field('query[nv_mode]', 0)
-            data.add_field('query[consigne_confort]', celsiusToAdc(
-                self.heaters[device_id].consigne_confort))
-            data.add_field('query[consigne_manuel]', celsiusToAdc(
-                self.heaters[device_id].consigne_manuel))
-        elif preset == 'Program':
-            _LOGGER.error('setting program attributes....')
-            self.heaters[device_id].gv_mode = 8
-            data.add_field('query[gv_mode]', 8)
-            data.add_field('query[nv_mode]', 8)
-            data.add_field('query[consigne_manuel]', celsiusToAdc(
-                self.heaters[device_id].consigne_manuel))
-        elif preset == 'eco':
-            self.heaters[device_id].gv_mode = 3
-            data.add_field('query[gv_mode]', 3)
-            data.add_field('query[nv_mode]', 3)
-            data.add_field('query[consigne_eco]', celsiusToAdc(
-                self.heaters[device_id].consigne_eco))
-            data.add_field('query[consigne_manuel]', celsiusToAdc(
-                self.heaters[device_id].consigne_manuel))
-        elif preset == 'boost':
-            self.heaters[device_id].gv_mode = 4
-            data.add_field('query[gv_mode]', 4)
-            data.add_field('query[nv_mode]', 4)
-            data.add_field('query[time_boost]', 7200)
-            data.add_field('query[consigne_boost]', celsiusToAdc(
-                self.heaters[device_id].consigne_boost))
-            data.add_field('query[consigne_manuel]', celsiusToAdc(
-                self.heaters[device_id].consigne_manuel))
-        elif preset == 'off':
-            self.heaters[device_id].gv_mode = 1
-            data.add_field('query[gv_mode]', 1)
-            data.add_field('query[nv_mode]', 1)
-            data.add_field('query[consigne_manuel]', 0)
-        else:
-            self.heaters[device_id].gv_mode = 2
-            data.add_field('query[gv_mode]', 2)
-            data.add_field('query[nv_mode]', 2)
-            data.add_field('query[consigne_manuel]', celsiusToAdc(
-                self.heaters[device_id].consigne_manuel))
-            data.add_field('query[consigne_hg]', celsiusToAdc(
-                self.heaters[device_id].consigne_hg))
+        heater = self.heaters[device_id]
+        mode, fields, extra = _PRESETS.get(preset, _DEFAULT_PRESET)
+        heater.gv_mode = mode
+        data = {
+            'query[id_device]': device_id,
+            'context': '1',
+            'smarthome_id': heater.smarthome_id,
+            'query[gv_mode]': mode,
+            'query[nv_mode]': mode,
+        }
+        for field in fields:
+            data['query[%s]' % field] = celsiusToAdc(getattr(heater, field))
+        data.update(extra)
 
         await self.request("query/push/", data)
 
-    def sync_set_heater_preset(self, device_id, preset):
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.set_heater_preset(device_id, preset))
-        loop.run_until_complete(task)
-
     async def throttle_update_heaters(self):
         """Throttle update device."""
-        if (self._throttle_time is not None
-                and dt.datetime.now() - self._throttle_time < MIN_TIME_BETWEEN_UPDATES):
-            return
-        self._throttle_time = dt.datetime.now()
         await self.update_heaters()
 
     async def throttle_update_all_heaters(self):
         """Throttle update all devices and rooms."""
-        if (self._throttle_all_time is not None
-                and dt.datetime.now() - self._throttle_all_time
-                < MIN_TIME_BETWEEN_UPDATES):
+        now = time.monotonic()
+        if now - self._throttle_all_time < MIN_TIME_BETWEEN_UPDATES:
             return
-        self._throttle_all_time = dt.datetime.now()
+        self._throttle_all_time = now
         await self.find_all_heaters()
 
     async def update_device(self, device_id):
@@ -345,13 +538,19 @@ class Lvi:
 
     async def find_all_heaters(self):
         """Find all heaters."""
-        await self.update_rooms()
-        await self.update_heaters()
+        # One read per smarthome returns both its zones and devices
+        for smarthome_id, data, error in await self._read_smarthomes(
+                errors=True):
+            if not isinstance(data, dict):
+                _LOGGER.error("Failed to fetch devices: %s", data)
+                continue
+            self._set_rooms(smarthome_id, data)
+            self._set_heaters(smarthome_id, data, error)
 
     async def heater_control(self, device_id, fan_status=None, power_status=None):
         """Set heater control."""
-        _LOGGER.info('Setting heater: ' + device_id + ' fan: ' +
-                     str(fan_status) + ' power_status: ' + str(power_status))
+        _LOGGER.info('Setting heater: %s fan: %s power_status: %s',
+                     device_id, fan_status, power_status)
         heater = self.heaters.get(device_id)
         if heater is None:
             _LOGGER.error("No such device")
@@ -362,142 +561,214 @@ class Lvi:
         if power_status is None:
             power_status = heater.power_status
 
-        data = aiohttp.FormData()
-        data.add_field('query[id_device]', device_id)
-        data.add_field('context', '1')
-        data.add_field('smarthome_id', self.heaters[device_id].smarthome_id)
+        data = {
+            'query[id_device]': device_id,
+            'context': '1',
+            'smarthome_id': self.heaters[device_id].smarthome_id,
+        }
         if power_status == 0:
-            data.add_field('query[consigne_manuel]', 0)
-            data.add_field('query[gv_mode]', 1)
-            data.add_field('query[nv_mode]', 1)
+            data['query[consigne_manuel]'] = 0
+            data['query[gv_mode]'] = 1
+            data['query[nv_mode]'] = 1
         else:
-            data.add_field('query[gv_mode]', 0)
-            data.add_field('query[nv_mode]', 0)
+            data['query[gv_mode]'] = 0
+            data['query[nv_mode]'] = 0
 
         await self.request("query/push/", data)
 
-    def sync_heater_control(self, device_id, fan_status=None, power_status=None):
+
+class SyncLvi:
+    """Blocking wrapper running a Lvi connection on a background loop."""
+
+    def __init__(self, username, password,
+                 timeout=DEFAULT_TIMEOUT):
+        """Initialize the LVI connection and its event loop thread."""
+        # The loop is private to this wrapper, so use a faster one if we can
+        policy = _fast_loop_policy()
+        if policy is None:
+            self._loop = asyncio.new_event_loop()
+        else:
+            self._loop = policy.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        self.lvi = self._run(Lvi.create(username, password, timeout))
+
+    def _run(self, coro):
+        """Run a coroutine on the background loop and wait for the result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @property
+    def rooms(self):
+        """Return the rooms of the connection."""
+        return self.lvi.rooms
+
+    @property
+    def heaters(self):
+        """Return the heaters of the connection."""
+        return self.lvi.heaters
+
+    def connect(self):
+        """Connect to LVI."""
+        return self._run(self.lvi.connect())
+
+    def close_connection(self):
+        """Close the Lvi connection and stop the event loop."""
+        self._run(self.lvi.close_connection())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def request(self, command, payload, retry=2):
+        """Request data."""
+        return self._run(self.lvi.request(command, payload, retry))
+
+    def update_rooms(self):
+        """Request data."""
+        return self._run(self.lvi.update_rooms())
+
+    def update_heaters(self):
+        """Request data."""
+        return self._run(self.lvi.update_heaters())
+
+    def find_all_heaters(self):
+        """Find all heaters."""
+        return self._run(self.lvi.find_all_heaters())
+
+    def set_heater_temp(self, device_id, set_temp):
+        """Set heater temperature."""
+        return self._run(self.lvi.set_heater_temp(device_id, set_temp))
+
+    def set_heater_temps(self, temps):
+        """Set temperatures of several heaters concurrently."""
+        return self._run(self.lvi.set_heater_temps(temps))
+
+    def set_heater_preset(self, device_id, preset):
+        """Update preset."""
+        return self._run(self.lvi.set_heater_preset(device_id, preset))
+
+    def heater_control(self, device_id, fan_status=None, power_status=None):
         """Set heater control."""
-        _LOGGER.info('Setting heater: ' + device_id + ' fan: ' +
-                     str(fan_status) + ' power_status: ' + str(power_status))
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(self.heater_control(
+        return self._run(self.lvi.heater_control(
             device_id, fan_status, power_status))
-        loop.run_until_complete(task)
 
 
-async def set_heater_values(self, heater_data, heater):
-    """Set heater values from heater data"""
+def set_heater_values(self, heater_data, heater):
+    """Set heater values from heater data
+
+    self is unused and only kept for API compatibility.
+    """
+    _copy_heater_fields(heater_data, heater)
     heater.current_temp = adcToCelsius(heater_data.get('temperature_air'))
-    heater.consigne_confort = adcToCelsius(
-        heater_data.get('consigne_confort'))  # Set Value
-    heater.consigne_hg = adcToCelsius(heater_data.get('consigne_hg'))
-    heater.consigne_boost = adcToCelsius(heater_data.get('consigne_boost'))
-    heater.consigne_eco = adcToCelsius(heater_data.get('consigne_eco'))
-    heater.consigne_manuel = adcToCelsius(
-        heater_data.get('consigne_manuel'))  # Set value
-    heater.min_set_point = adcToCelsius(heater_data.get('min_set_point'))
-    heater.max_set_point = adcToCelsius(heater_data.get('max_set_point'))
-
-    heater.num_zone = heater_data.get('num_zone')
-    heater.id_appareil = heater_data.get('id_appareil')
-    heater.date_start_boost = heater_data.get('date_start_boost')
-    heater.time_boost = heater_data.get('time_boost')
-    heater.nv_mode = heater_data.get('nv_mode')
-    heater.gv_mode = heater_data.get('gv_mode')
-    heater.temperature_sol = adcToCelsius(heater_data.get('temperature_sol'))
+
     heater.power_status = 0 if heater_data.get('consigne_manuel') == '0' and heater_data.get(
         'nv_mode') == '0' and heater_data.get('gv_mode') == '1' else 1
-    heater.pourcent_light = heater_data.get('pourcent_light')
-    heater.status_com = heater_data.get('status_com')
-    heater.recep_status_global = heater_data.get('recep_status_global')
-
-    heater.puissance_app = heater_data.get('puissance_app')
-    heater.smarthome_id = heater_data.get('smarthome_id')
-    heater.bundle_id = heater_data.get('bundle_id')
-    heater.date_update = heater_data.get('date_update')
     heater.heating_up = False if heater_data.get('heating_up') == '0' else True
-    heater.heat_cool = heater_data.get('heat_cool')
-    heater.fan_speed = heater_data.get('fan_speed')
-    heater.available = False
-    heater.room = self.rooms.get(heater_data.get('num_zone'))
-    heater.nom_appareil = heater_data.get('nom_appareil')
     heater.fan_status = 1 if heater_data.get('fan_speed') != '0' else 0
 
 
+def _smarthome_form(smarthome_id, **fields):
+    """Create form data for a smarthome request."""
+    return dict(fields, smarthome_id=smarthome_id)
+
+
+@functools.lru_cache(maxsize=256)
 def celsiusToAdc(celsius):
     return int(410 + (celsius - 5)*18)
 
 
-def adcToCelsius(adc):
-    if int(adc) < 410:
-        return int(adc)
+def _adcToCelsius(adc):
+    if adc < 410:
+        return adc
     else:
-        return int((int(adc)-410)/18 + 5)
+        return int((adc-410)/18 + 5)
+
+
+_ADC_TO_CELSIUS = [_adcToCelsius(adc) for adc in range(3000)]
+
+
+def adcToCelsius(adc):
+    adc = int(adc)
+    if 0 <= adc < len(_ADC_TO_CELSIUS):
+        return _ADC_TO_CELSIUS[adc]
+    return _adcToCelsius(adc)
 
 
 class SmartHome:
-    smarthome_id = None
-    mac_address = None
-    label = None
-    general_mode = None
-    holiday_mode = None
-    sync_flag = None
+    """Representation of smarthome."""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('smarthome_id', 'mac_address', 'label', 'general_mode',
+                 'holiday_mode', 'sync_flag')
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
+
+    def __repr__(self):
+        items = ("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
+        return "%s(%s)" % (self.__class__.__name__, ', '.join(items))
 
 
 class Room:
     """Representation of zone."""
     # pylint: disable=too-few-public-methods
-    zone_id = None
-    name = None
-    num_zone = None
-    label_zone_type = None
-    picto_zone_type = None
-    zone_img_id = None
-    address_position = None
+    __slots__ = ('zone_id', 'name', 'num_zone', 'label_zone_type',
+                 'picto_zone_type', 'zone_img_id', 'address_position')
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
 
     def __repr__(self):
-        items = ("%s=%r" % (k, v) for k, v in self.__dict__.items())
+        items = ("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
         return "%s(%s)" % (self.__class__.__name__, ', '.join(items))
 
 
 class Heater:
     """Representation of heater."""
     # pylint: disable=too-few-public-methods
-    id = None
-    device_id = None
-    nom_appareil = None
-    num_zone = None
-    id_appareil = None
-    current_temp = None
-    consigne_confort = None
-    consigne_hg = None
-    consigne_eco = None
-    consigne_boost = None
-    consigne_manuel = None
-    min_set_point = None
-    max_set_point = None
-    date_start_boost = None
-    time_boost = None
-    nv_mode = None
-    temperature_air = None
-    temperature_sol = None
-    power_status = None
-    pourcent_light = None
-    status_com = None
-    recep_status_global = None
-    gv_mode = None
-    puissance_app = None
-    smarthome_id = None
-    bundle_id = None
-    date_update = None
-    heating_up = None
-    heat_cool = None
-    fan_speed = None
-    room = None
-    available = False
-    fan_status = None
+    __slots__ = ('id', 'device_id', 'nom_appareil', 'num_zone', 'id_appareil',
+                 'current_temp', 'consigne_confort', 'consigne_hg',
+                 'consigne_eco', 'consigne_boost', 'consigne_manuel',
+                 'min_set_point', 'max_set_point', 'date_start_boost',
+                 'time_boost', 'nv_mode', 'temperature_air',
+                 'temperature_sol', 'power_status', 'pourcent_light',
+                 'status_com', 'recep_status_global', 'gv_mode',
+                 'puissance_app', 'smarthome_id', 'bundle_id', 'date_update',
+                 'heating_up', 'heat_cool', 'fan_speed', 'room', 'available',
+                 'fan_status')
+    # Fields copied as is from the device data
+    _FIELDS = ('num_zone', 'id_appareil', 'date_start_boost', 'time_boost',
+               'nv_mode', 'gv_mode', 'pourcent_light', 'status_com',
+               'recep_status_global', 'puissance_app', 'smarthome_id',
+               'bundle_id', 'date_update', 'heat_cool', 'fan_speed',
+               'nom_appareil')
+    # Temperature fields converted from ADC values
+    _ADC_FIELDS = ('consigne_confort', 'consigne_hg', 'consigne_boost',
+                   'consigne_eco', 'consigne_manuel', 'min_set_point',
+                   'max_set_point', 'temperature_sol')
+
+    def __init__(self):
+        for attr in self.__slots__:
+            setattr(self, attr, None)
+        self.available = False
 
     def __repr__(self):
-        items = ("%s=%r" % (k, v) for k, v in self.__dict__.items())
+        items = ("%s=%r" % (k, getattr(self, k)) for k in self.__slots__)
         return "%s(%s)" % (self.__class__.__name__, ', '.join(items))
+
+
+def _make_heater_copier():
+    """Generate a function copying the Heater fields from device data."""
+    lines = ["def copy_heater_fields(heater_data, heater):",
+             "    get = heater_data.get"]
+    lines += ["    heater.%s = get(%r)" % (field, field)
+              for field in Heater._FIELDS]
+    lines += ["    heater.%s = adcToCelsius(get(%r))" % (field, field)
+              for field in Heater._ADC_FIELDS]
+    namespace = {'adcToCelsius': adcToCelsius}
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return namespace['copy_heater_fields']
+
+
+_copy_heater_fields = _make_heater_copier()
@@ -11,7 +11,8 @@ with open("README.md", 'r') as fp:
 setup(
     name='lviheater',
     packages=find_packages(exclude=['tests']),
-    install_requires=['aiohttp>=3.0.6'],
+    install_requires=['aiohttp>=3.3'],
+    extras_require={'speedups': ['orjson']},
     version='0.1.1',
     description='A python3 library to communicate with LVI',
     long_description=long_description,
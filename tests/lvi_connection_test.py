@@ -12,17 +12,17 @@ class TestConnection(TestCase):
 
     def test_constructor(self):
 
-        data = aiohttp.FormData()
-        lvi_connection = Lvi('xxx','xxx')
-        lvi_connection.sync_connect()
+        async def run():
+            async with await Lvi.create('xxx','xxx') as lvi_connection:
+                await lvi_connection.connect()
 
-        lvi_connection.sync_update_rooms()
-        lvi_connection.sync_update_heaters()
-       # lvi_connection.update_device('C001-000')
-       # heater = next(iter(lvi_connection.heaters.values()))
-       # lvi_connection.sync_set_heater_temp(heater.id_device, 25)
+                await lvi_connection.update_rooms()
+                await lvi_connection.update_heaters()
+               # await lvi_connection.update_device('C001-000')
+               # heater = next(iter(lvi_connection.heaters.values()))
+               # await lvi_connection.set_heater_temp(heater.device_id, 25)
 
-        lvi_connection.sync_close_connection()
+        asyncio.run(run())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,436 @@
+import asyncio
+import json
+from unittest import TestCase, mock
+from urllib.parse import parse_qsl
+
+import aiohttp
+
+import lvi
+from lvi import Lvi, Heater
+
+AUTH = {"code": {"code": "1"},
+        "data": {"token": "token",
+                 "user_infos": {"user_id": "user",
+                                "token_expire": "2099-01-01 00:00:00"}}}
+OK = {"code": {"code": "1"}, "data": {}}
+
+
+class FakeResponse:
+    """Response returned by FakeSession.post."""
+
+    def __init__(self, status, body):
+        self.status = status
+        self._body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def read(self):
+        # Yield like a real read so concurrent callers can interleave
+        await asyncio.sleep(0)
+        return self._body
+
+
+class FakeError:
+    """Context manager raising an exception when entered."""
+
+    def __init__(self, exc):
+        self._exc = exc
+
+    async def __aenter__(self):
+        raise self._exc
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeSession:
+    """Session answering posts by url command.
+
+    handler(command, form) returns a dict, raw bytes, a (status, dict)
+    tuple or an exception instance.
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self.calls = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        command = url.rsplit('/human/', 1)[1]
+        form = dict(parse_qsl(data.decode('utf-8')))
+        self.calls.append((command, form))
+        result = self._handler(command, form)
+        if isinstance(result, Exception):
+            return FakeError(result)
+        status = 200
+        if isinstance(result, tuple):
+            status, result = result
+        if not isinstance(result, bytes):
+            result = json.dumps(result).encode('utf-8')
+        return FakeResponse(status, result)
+
+    def commands(self, command):
+        return [form for cmd, form in self.calls if cmd == command]
+
+    async def close(self):
+        pass
+
+
+def device(id_device, smarthome_id, num_zone='1'):
+    data = {field: '450' for field in Heater._FIELDS + Heater._ADC_FIELDS}
+    data.update(id_device=id_device, smarthome_id=smarthome_id,
+                num_zone=num_zone, temperature_air='500', fan_speed='0',
+                heating_up='0', nv_mode='0', gv_mode='2')
+    return data
+
+
+def homes_handler(homes, errors=None):
+    """Handler serving the given {smarthome_id: (zones, devices)}."""
+
+    def handler(command, form):
+        if command == 'user/auth':
+            return AUTH
+        if command == 'user/read':
+            return {"code": {"code": "1"},
+                    "data": {"smarthomes": {
+                        str(i): {"smarthome_id": _id}
+                        for i, _id in enumerate(homes)}}}
+        if command == '/smarthome/read/':
+            zones, devices = homes[form['smarthome_id']]
+            return {"code": {"code": "1"},
+                    "data": {"zones": zones, "devices": devices}}
+        if command == '/smarthome/get_errors/':
+            if errors is not None:
+                return errors
+            return {"code": {"code": "1"},
+                    "data": {"results": {"by_device": {}}}}
+        return OK
+    return handler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def connected(session):
+    connection = Lvi('user', 'pass', websession=session)
+    await connection.connect()
+    return connection
+
+
+class OfflineTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(lvi, 'RETRY_BACKOFF', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestRooms(OfflineTestCase):
+
+    def test_zones_of_different_homes(self):
+        session = FakeSession(homes_handler({
+            'A': ({'za': {'num_zone': '1', 'zone_label': 'Living A'}},
+                  {'0': device('DA', 'A')}),
+            'B': ({'zb': {'num_zone': '1', 'zone_label': 'Living B'}},
+                  {'0': device('DB', 'B')}),
+        }))
+
+        async def test():
+            connection = Lvi('user', 'pass', websession=session)
+            await connection.connect()
+            await connection.find_all_heaters()
+            return connection
+
+        connection = run(test())
+        self.assertEqual(connection.heaters['DA'].room.name, 'Living A')
+        self.assertEqual(connection.heaters['DB'].room.name, 'Living B')
+        self.assertEqual(connection.rooms[('A', '1')].name, 'Living A')
+
+
+class TestBreaker(OfflineTestCase):
+
+    def _failing_handler(self, failure, failures):
+        """Fail the first failures 'x' requests, then succeed."""
+        state = {'failures': failures}
+
+        def handler(command, form):
+            if command == 'user/auth':
+                return AUTH
+            if state['failures']:
+                state['failures'] -= 1
+                return failure
+            return OK
+        return handler
+
+    def _assert_opens(self, failure):
+        session = FakeSession(self._failing_handler(failure, 100))
+
+        async def test():
+            connection = await connected(session)
+            result = await connection.request('x', {}, retry=10)
+            self.assertIsNone(result)
+            self.assertTrue(connection._breaker_open())
+            self.assertEqual(len(session.commands('x')),
+                             lvi.BREAKER_FAILURES + 1)
+            # Open breaker fails fast without sending anything
+            self.assertIsNone(await connection.request('x', {}))
+            self.assertEqual(len(session.commands('x')),
+                             lvi.BREAKER_FAILURES + 1)
+
+        run(test())
+
+    def test_timeouts_open_breaker(self):
+        self._assert_opens(asyncio.TimeoutError())
+
+    def test_server_errors_open_breaker(self):
+        self._assert_opens((500, OK))
+
+    def test_client_errors_open_breaker(self):
+        self._assert_opens(aiohttp.ClientConnectionError())
+
+    def test_success_clears_failures(self):
+        session = FakeSession(
+            self._failing_handler(asyncio.TimeoutError(),
+                                  lvi.BREAKER_FAILURES))
+
+        async def test():
+            connection = await connected(session)
+            self.assertEqual(await connection.request('x', {}), OK)
+            self.assertFalse(connection._failures)
+            for _ in range(lvi.BREAKER_FAILURES):
+                connection._record_failure()
+            self.assertFalse(connection._breaker_open())
+
+        run(test())
+
+    def test_connect_failures_open_breaker(self):
+        session = FakeSession(lambda command, form: asyncio.TimeoutError())
+
+        async def test():
+            connection = Lvi('user', 'pass', websession=session)
+            self.assertFalse(await connection.connect(retry=10))
+            self.assertTrue(connection._breaker_open())
+            self.assertEqual(len(session.calls), lvi.BREAKER_FAILURES + 1)
+
+        run(test())
+
+
+class TestSingleFlight(OfflineTestCase):
+
+    def test_concurrent_connect(self):
+        session = FakeSession(lambda command, form: asyncio.TimeoutError())
+
+        async def test():
+            connection = Lvi('user', 'pass', websession=session)
+            results = await asyncio.gather(
+                *[connection.connect(retry=2) for _ in range(5)])
+            self.assertEqual(results, [False] * 5)
+            self.assertEqual(len(session.commands('user/auth')), 3)
+
+        run(test())
+
+    def test_concurrent_update_heaters(self):
+        session = FakeSession(homes_handler({
+            'A': ({}, {'0': device('DA', 'A')}),
+        }))
+
+        async def test():
+            connection = await connected(session)
+            await asyncio.gather(
+                *[connection.update_heaters() for _ in range(5)])
+            self.assertEqual(len(session.commands('/smarthome/read/')), 1)
+            self.assertIn('DA', connection.heaters)
+
+        run(test())
+
+    def test_concurrent_get_smarthome_list(self):
+        session = FakeSession(homes_handler({'A': ({}, {})}))
+
+        async def test():
+            connection = await connected(session)
+            results = await asyncio.gather(
+                *[connection.get_smarthome_list() for _ in range(5)])
+            self.assertEqual(len(session.commands('user/read')), 1)
+            self.assertEqual(results, [{'0': {'smarthome_id': 'A'}}] * 5)
+
+        run(test())
+
+
+class TestThrottle(OfflineTestCase):
+
+    def test_update_heaters_throttled(self):
+        session = FakeSession(homes_handler({
+            'A': ({}, {'0': device('DA', 'A')}),
+        }))
+
+        async def test():
+            connection = await connected(session)
+            await connection.update_heaters()
+            await connection.update_heaters()
+            self.assertEqual(len(session.commands('/smarthome/read/')), 1)
+            # Once MIN_TIME_BETWEEN_UPDATES has passed it updates again
+            connection._throttle_time -= lvi.MIN_TIME_BETWEEN_UPDATES
+            await connection.update_heaters()
+            self.assertEqual(len(session.commands('/smarthome/read/')), 2)
+
+        run(test())
+
+
+class TestAvailability(OfflineTestCase):
+
+    def test_failed_errors_lookup_keeps_availability(self):
+        errors = {"code": {"code": "1"},
+                  "data": {"results": {"by_device": {"DA": {}}}}}
+        homes = {'A': ({}, {'0': device('DA', 'A')})}
+
+        async def test():
+            session = FakeSession(homes_handler(homes, errors))
+            connection = await connected(session)
+            await connection.update_heaters()
+            self.assertFalse(connection.heaters['DA'].available)
+
+            connection.websession = FakeSession(
+                homes_handler(homes, asyncio.TimeoutError()))
+            connection._throttle_time = 0.0
+            await connection.update_heaters()
+            self.assertFalse(connection.heaters['DA'].available)
+
+        run(test())
+
+
+class TestPresets(OfflineTestCase):
+
+    # Query fields pushed by the former if/elif implementation
+    EXPECTED = {
+        'comfort': {'query[gv_mode]': '0', 'query[nv_mode]': '0',
+                    'query[consigne_confort]': '428',
+                    'query[consigne_manuel]': '446'},
+        'Program': {'query[gv_mode]': '8', 'query[nv_mode]': '8',
+                    'query[consigne_manuel]': '446'},
+        'eco': {'query[gv_mode]': '3', 'query[nv_mode]': '3',
+                'query[consigne_eco]': '464',
+                'query[consigne_manuel]': '446'},
+        'boost': {'query[gv_mode]': '4', 'query[nv_mode]': '4',
+                  'query[time_boost]': '7200',
+                  'query[consigne_boost]': '482',
+                  'query[consigne_manuel]': '446'},
+        'off': {'query[gv_mode]': '1', 'query[nv_mode]': '1',
+                'query[consigne_manuel]': '0'},
+        'frost': {'query[gv_mode]': '2', 'query[nv_mode]': '2',
+                  'query[consigne_manuel]': '446',
+                  'query[consigne_hg]': '410'},
+    }
+
+    def test_preset_queries(self):
+        session = FakeSession(homes_handler({}))
+
+        async def test():
+            connection = await connected(session)
+            heater = Heater()
+            heater.smarthome_id = 'A'
+            heater.consigne_hg = 5
+            heater.consigne_confort = 6
+            heater.consigne_manuel = 7
+            heater.consigne_eco = 8
+            heater.consigne_boost = 9
+            connection.heaters['D'] = heater
+            for preset, expected in self.EXPECTED.items():
+                await connection.set_heater_preset('D', preset)
+                form = session.commands('query/push/')[-1]
+                self.assertEqual(form, dict(expected, **{
+                    'query[id_device]': 'D', 'context': '1',
+                    'smarthome_id': 'A', 'token': 'token',
+                    'email': 'user'}), preset)
+                self.assertEqual(str(heater.gv_mode),
+                                 expected['query[gv_mode]'])
+
+        run(test())
+
+
+class TestToken(OfflineTestCase):
+
+    def test_expired_token_reconnects(self):
+        tokens = iter(['token', 'new token'])
+
+        def handler(command, form):
+            if command == 'user/auth':
+                return dict(AUTH, data=dict(AUTH['data'], token=next(tokens)))
+            return OK
+        session = FakeSession(handler)
+
+        async def test():
+            connection = await connected(session)
+            connection._token_expire = 0
+            self.assertEqual(await connection.request('x', {}), OK)
+            self.assertEqual(len(session.commands('user/auth')), 2)
+            self.assertEqual(session.commands('x')[0]['token'], 'new token')
+
+        run(test())
+
+    def test_revoked_token_reconnects(self):
+        tokens = iter(['token', 'new token'])
+
+        def handler(command, form):
+            if command == 'user/auth':
+                return dict(AUTH, data=dict(AUTH['data'], token=next(tokens)))
+            if form['token'] == 'token':
+                return {"code": {"code": "3"}}
+            return OK
+        session = FakeSession(handler)
+
+        async def test():
+            connection = await connected(session)
+            self.assertEqual(await connection.request('x', {}), OK)
+            self.assertEqual(len(session.commands('user/auth')), 2)
+            self.assertEqual([form['token'] for form in session.commands('x')],
+                             ['token', 'new token'])
+
+        run(test())
+
+
+class TestResponseCodes(OfflineTestCase):
+
+    def _request(self, body):
+        session = FakeSession(
+            lambda command, form: AUTH if command == 'user/auth' else body)
+
+        async def test():
+            connection = await connected(session)
+            return await connection.request('x', {})
+
+        return run(test())
+
+    def test_auth_failed_body(self):
+        self.assertIs(self._request(b'{"code":{"code":"3"},"data":{}}'),
+                      False)
+
+    def test_null_code(self):
+        self.assertIs(self._request({"code": None, "data": {}}), False)
+
+    def test_missing_code(self):
+        self.assertIs(self._request({"data": {}}), False)
+
+    def test_connect_auth_failed(self):
+        session = FakeSession(
+            lambda command, form: b'{"code":{"code":"3"},"data":{}}')
+
+        async def test():
+            connection = Lvi('user', 'pass', websession=session)
+            self.assertFalse(await connection.connect())
+            self.assertIsNone(connection._token)
+
+        run(test())
+
+    def test_connect_null_code(self):
+        session = FakeSession(
+            lambda command, form: {"code": None, "data": AUTH['data']})
+
+        async def test():
+            connection = Lvi('user', 'pass', websession=session)
+            self.assertTrue(await connection.connect())
+
+        run(test())